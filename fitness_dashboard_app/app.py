@@ -1,6 +1,6 @@
 import streamlit as st
 from pathlib import Path
-from db import init_db, get_session
+from db import init_db, get_session, current_user
 from models import User
 
 # --- Streamlit config must be first ---
@@ -35,7 +35,10 @@ def bootstrap_user() -> User:
             sess.refresh(u)
         return u
 
-user = bootstrap_user()
+user = current_user()
+if user is None:
+    bootstrap_user()
+    user = current_user()
 
 # --- Sidebar: profile ---
 st.sidebar.header("Profile")
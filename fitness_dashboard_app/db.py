@@ -1,15 +1,75 @@
 from __future__ import annotations
-from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel import SQLModel, create_engine, Session, select
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import IntegrityError
+import streamlit as st
 import os
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "data", "fitness.db")
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
+# SQLAlchemy 2.x pools file-backed SQLite connections (QueuePool), so the PRAGMAs
+# below run once per pooled connection rather than once per session.
 engine = create_engine(f"sqlite:///{DB_PATH}", echo=False, connect_args={"check_same_thread": False})
 
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_conn, _record):
+    """Tune SQLite for a local single-user app: WAL + relaxed fsync + bigger caches."""
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA mmap_size=268435456")  # 256 MB (upper bound; only the file size is mapped)
+    cur.execute("PRAGMA cache_size=-65536")    # 64 MB (negative = KiB)
+    cur.close()
+
 def init_db():
     from models import User, DailyMetric, Measurement, Wellbeing, Adherence, Photo, Week, Expense  # ensure tables imported
     SQLModel.metadata.create_all(engine)
+    # create_all skips tables that already exist, so add any indexes declared later
+    # to existing DBs too (IF NOT EXISTS; a no-op once they are there).
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(engine, checkfirst=True)
+            except IntegrityError:
+                # legacy rows violate a unique index; keep the app usable without it
+                pass
+
+# expire_on_commit=False: objects stay loaded after commit, so a save doesn't
+# trigger a refetch SELECT for every attribute read afterwards.
+SessionLocal = sessionmaker(bind=engine, class_=Session, expire_on_commit=False)
 
 def get_session() -> Session:
-    return Session(engine)
+    return SessionLocal()
+
+def cached_session() -> Session:
+    """Return one long-lived Session per Streamlit browser session.
+
+    Stored in st.session_state (rather than st.cache_resource or a process-wide
+    scoped_session registry) so separate browser sessions never share a Session
+    across script threads, and Streamlit drops it when the browser session ends.
+    Callers commit explicitly and should rollback() on failure.
+    """
+    sess = st.session_state.get("_db_session")
+    if sess is None:
+        sess = st.session_state["_db_session"] = SessionLocal()
+    return sess
+
+def current_user():
+    """Return the app's single local User, looked up once per Streamlit browser session.
+
+    Kept in st.session_state alongside cached_session(), so reruns and page switches
+    skip the SELECT. The object is detached (expire_on_commit=False keeps its
+    attributes loaded); the profile form in app.py updates this same instance.
+    Returns None, without caching, while no user exists yet.
+    """
+    user = st.session_state.get("_current_user")
+    if user is None:
+        from models import User
+        with get_session() as sess:
+            user = sess.exec(select(User)).first()
+        if user is not None:
+            st.session_state["_current_user"] = user
+    return user
@@ -2,6 +2,7 @@
 from typing import Optional, List
 from datetime import date
 from sqlmodel import Field, SQLModel, Relationship
+from sqlalchemy import Index
 
 class User(SQLModel, table=True):
     __tablename__ = "user"                       # ⬅️ back to original table name
@@ -19,16 +20,24 @@ class User(SQLModel, table=True):
 
 class Week(SQLModel, table=True):
     __tablename__ = "week"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        # one week per (user, Monday); also the ON CONFLICT target in get_or_create_week
+        Index("ux_week_user_start", "user_id", "start_date", unique=True),
+        {"extend_existing": True},
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
-    week_number: int
+    week_number: int = Field(index=True)  # ORDER BY week_number DESC for the next number
     start_date: date
 
     # many-to-one
     user: Optional[User] = Relationship(back_populates="weeks")
 
+    # Relationships below stay lazy on purpose: the loaders in utils read these tables with
+    # SQL, and the pages load Week rows (get_or_create_week, Manage Data, CSV import) without
+    # touching them, so an eager default (lazy="selectin") would add 4 queries per Week load.
+
     # one-to-many
     dailies: List["DailyMetric"] = Relationship(back_populates="week")
     photos: List["Photo"] = Relationship(back_populates="week")
@@ -40,7 +49,10 @@ class Week(SQLModel, table=True):
 
 class DailyMetric(SQLModel, table=True):
     __tablename__ = "dailymetric"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        Index("ix_daily_user_date", "user_id", "date"),
+        {"extend_existing": True},
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
@@ -54,7 +66,10 @@ class DailyMetric(SQLModel, table=True):
 
 class Measurement(SQLModel, table=True):
     __tablename__ = "measurement"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        Index("ix_measurement_user_week", "user_id", "week_id"),
+        {"extend_existing": True},
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
@@ -71,7 +86,10 @@ class Measurement(SQLModel, table=True):
 
 class Wellbeing(SQLModel, table=True):
     __tablename__ = "wellbeing"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        Index("ix_wellbeing_user_week", "user_id", "week_id"),
+        {"extend_existing": True},
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
@@ -85,7 +103,10 @@ class Wellbeing(SQLModel, table=True):
 
 class Adherence(SQLModel, table=True):
     __tablename__ = "adherence"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        Index("ix_adherence_user_week", "user_id", "week_id"),
+        {"extend_existing": True},
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
@@ -1,11 +1,14 @@
 # pages/1_📊_Dashboard.py
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
-from sqlmodel import select
-from db import get_session
-from models import User
-from utils import load_daily_df, load_weekly_df, rolling_avg, load_expenses_df, expense_metrics, load_css
+import plotly.graph_objects as go
+from db import current_user
+from utils import (
+    cached_daily_df, cached_weekly_df, cached_expenses_df, rolling_avg, expense_metrics, load_css,
+    steps_to_km_series, downsample_minmax, KM_PER_STEP,
+)
 
 st.set_page_config(page_title="📊 Progress Dashboard", page_icon="📊", layout="wide")
 load_css(show_warning=False)
@@ -13,22 +16,18 @@ load_css(show_warning=False)
 st.title("📊 Fitness Dashboard")
 
 # ---------- helpers ----------
-def steps_to_km(series: pd.Series) -> pd.Series:
-    s = pd.to_numeric(series, errors="coerce")
-    return (s * 8.0) / (1780.0 * 5.0)
+_ISSUE = ("😄", "🙂", "😐", "😕", "😣", "😫")                                   # 0..5
+_ADH = ("❌", "❌", "❌", "❌", "⚠️", "⚠️", "👍", "👍", "🔥", "🔥", "🔥")   # 0..10
 
 def issue_emoji(v):
-    try: v = int(v)
+    try: i = int(v)
     except Exception: return "—"
-    return ["😄","🙂","😐","😕","😣","😫"][max(0, min(5, v))]
+    return _ISSUE[0 if i < 0 else 5 if i > 5 else i]
 
 def adherence_emoji(v):
-    try: v = int(v)
+    try: i = int(v)
     except Exception: return "—"
-    if v >= 8: return "🔥"
-    if v >= 6: return "👍"
-    if v >= 4: return "⚠️"
-    return "❌"
+    return _ADH[0 if i < 0 else 10 if i > 10 else i]
 
 def nice_y_range(series: pd.Series, pad_ratio=0.10):
     s = pd.to_numeric(series, errors="coerce").dropna()
@@ -40,12 +39,49 @@ def nice_y_range(series: pd.Series, pad_ratio=0.10):
     pad = (hi - lo) * pad_ratio
     return [lo - pad, hi + pad]
 
+# ---------- cached figure builders (keyed on the plotted data; cleared with the loaders) ----------
+# Long histories are min/max-downsampled before plotting so the browser gets ≤ ~1000 points per trace.
+@st.cache_data(show_spinner=False, max_entries=32)
+def _weight_chart(frame: pd.DataFrame, smooth: int) -> go.Figure:
+    s = frame.copy()
+    s["smooth"] = rolling_avg(s["weight_kg"], smooth)
+    fig = px.line(downsample_minmax(s, "smooth"), x="day", y="smooth", markers=True, title="Daily Weight (smoothed)")
+    rng = nice_y_range(s["smooth"])
+    if rng:
+        fig.update_yaxes(range=rng)
+    else:
+        # if all values identical or single point, give a small visual band
+        v = float(s["smooth"].dropna().iloc[-1]) if s["smooth"].notna().any() else 0.0
+        fig.update_yaxes(range=[v - 0.5, v + 0.5])
+    fig.update_xaxes(dtick="D1", tickformat="%b %-d, %Y")
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _daily_chart(frame: pd.DataFrame, col: str, title: str, kind: str) -> go.Figure:
+    plot_df = downsample_minmax(frame, col)
+    fig = px.bar(plot_df, x="day", y=col, title=title) if kind == "bar" else \
+          px.line(plot_df, x="day", y=col, markers=True, title=title)
+    fig.update_xaxes(dtick="D1", tickformat="%b %-d, %Y")
+    rng = nice_y_range(frame[col])
+    if rng:
+        fig.update_yaxes(range=rng)
+    else:
+        v = float(pd.to_numeric(frame[col], errors="coerce").dropna().iloc[-1]) if frame[col].notna().any() else 0.0
+        pad = max(abs(v) * 0.1, 0.5)
+        fig.update_yaxes(range=[v - pad, v + pad])
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _weekly_chart(frame: pd.DataFrame, y: str, title: str, kind: str) -> go.Figure:
+    if kind == "bar":
+        return px.bar(frame, x="week_number", y=y, title=title)
+    return px.line(frame, x="week_number", y=y, markers=True, title=title)
+
 # ---------- load ----------
-with get_session() as sess:
-    user = sess.exec(select(User)).first()
-    daily_raw = load_daily_df(sess, user.id)
-    weekly = load_weekly_df(sess, user.id)
-    expenses_df = load_expenses_df(sess, user.id)
+user = current_user()
+daily_raw = cached_daily_df(user.id)
+weekly = cached_weekly_df(user.id)
+expenses_df = cached_expenses_df(user.id)
 
 if daily_raw.empty:
     st.info("No data yet. Add entries in **📝 Data Entry**.")
@@ -77,31 +113,33 @@ with st.sidebar:
     show_tables = st.checkbox("Show Daily & Weekly tables", True)
 
 # ---------- DAILY: canonical day + resample to 1 row/day ----------
-daily = daily_raw.copy()
+# only the columns the charts/KPIs read, so every later pass moves fewer bytes
+daily = daily_raw[["date", "weight_kg", "steps"]].copy()
 
-# canonicalize timestamps: make tz-aware in UTC, then convert to naive midnight
-ts = pd.to_datetime(daily["date"], utc=True, errors="coerce")
-daily["day"] = pd.to_datetime(ts.dt.date)  # naive midnight (YYYY-MM-DD 00:00:00)
+# canonicalize timestamps: floor to naive midnight (YYYY-MM-DD 00:00:00) with one NumPy cast
+dates = pd.to_datetime(daily["date"], errors="coerce").to_numpy("datetime64[ns]")
+daily["day"] = dates.astype("datetime64[D]").astype("datetime64[ns]")
 
-# filter by range using date part
-mask = (daily["day"].dt.date >= date_start) & (daily["day"].dt.date <= date_end)
+# filter by range on datetime64 directly (NaT compares False, so unparseable dates drop out)
+day_arr = daily["day"].to_numpy()
+mask = (day_arr >= np.datetime64(date_start)) & (day_arr <= np.datetime64(date_end))
 daily = daily.loc[mask].copy()
 
-# ensure numeric
-daily["weight_kg"] = pd.to_numeric(daily["weight_kg"], errors="coerce")
-daily["steps"]     = pd.to_numeric(daily["steps"], errors="coerce")
+# ensure numeric (one coercion per column, plain float64 for the NumPy paths below)
+daily["weight_kg"] = pd.to_numeric(daily["weight_kg"], errors="coerce").astype("float64")
+daily["steps"]     = pd.to_numeric(daily["steps"], errors="coerce").astype("float64")
 
 # resample guarantees ONE ROW per calendar day (averages if multiple logs)
 daily_day = (
-    daily.set_index("day")
+    daily.set_index("day")[["weight_kg", "steps"]]
          .sort_index()
          .resample("D")
-         .mean(numeric_only=True)
+         .mean()
          .reset_index()
 )
 
-# derived km
-daily_day["km_calc"] = steps_to_km(daily_day["steps"]).round(2)
+# derived km (NumPy multiply on the float64 buffer)
+daily_day["km_calc"] = (daily_day["steps"].to_numpy() * KM_PER_STEP).round(2)
 
 # ---------- WEEKLY: filters + derived avg_km ----------
 weekly_f = weekly.copy()
@@ -113,7 +151,7 @@ if not weekly_f.empty:
     ws = weekly_f["workout_score"].fillna(10)
     weekly_f = weekly_f[(ds >= adherence_min) & (ws >= adherence_min)]
     if "avg_steps" in weekly_f.columns:
-        weekly_f["avg_km_calc"] = steps_to_km(weekly_f["avg_steps"]).round(2)
+        weekly_f["avg_km_calc"] = steps_to_km_series(weekly_f["avg_steps"]).round(2)
 
 # ---------- KPIs ----------
 kpi = st.columns(4)
@@ -199,18 +237,7 @@ if not weekly_f.empty:
 
 # ---------- Daily charts (x='day' ensures date axis; resample removed duplicates) ----------
 if show_weight and daily_day["weight_kg"].notna().any():
-    s = daily_day[["day", "weight_kg"]].copy()
-    s["smooth"] = rolling_avg(s["weight_kg"], smooth)
-    fig = px.line(s, x="day", y="smooth", markers=True, title="Daily Weight (smoothed)")
-    rng = nice_y_range(s["smooth"])
-    if rng:
-        fig.update_yaxes(range=rng)
-    else:
-        # if all values identical or single point, give a small visual band
-        v = float(s["smooth"].dropna().iloc[-1]) if s["smooth"].notna().any() else 0.0
-        fig.update_yaxes(range=[v - 0.5, v + 0.5])
-    fig.update_xaxes(dtick="D1", tickformat="%b %-d, %Y")
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(_weight_chart(daily_day[["day", "weight_kg"]], smooth), use_container_width=True)
 
 charts = []
 if show_steps and daily_day["steps"].notna().any():
@@ -221,25 +248,15 @@ if show_km and daily_day["km_calc"].notna().any():
 if charts:
     cols = st.columns(len(charts))
     for idx, (title, col, kind) in enumerate(charts):
-        fig = px.bar(daily_day, x="day", y=col, title=title) if kind == "bar" else \
-              px.line(daily_day, x="day", y=col, markers=True, title=title)
-        fig.update_xaxes(dtick="D1", tickformat="%b %-d, %Y")
-        rng = nice_y_range(daily_day[col])
-        if rng:
-            fig.update_yaxes(range=rng)
-        else:
-            v = float(pd.to_numeric(daily_day[col], errors="coerce").dropna().iloc[-1]) if daily_day[col].notna().any() else 0.0
-            pad = max(abs(v) * 0.1, 0.5)
-            fig.update_yaxes(range=[v - pad, v + pad])
-        cols[idx].plotly_chart(fig, use_container_width=True)
+        cols[idx].plotly_chart(_daily_chart(daily_day[["day", col]], col, title, kind), use_container_width=True)
 
 # ---------- Weekly charts ----------
 if not weekly_f.empty:
     row = []
     if "avg_weight_kg" in weekly_f.columns and weekly_f["avg_weight_kg"].notna().any():
-        row.append(px.line(weekly_f, x="week_number", y="avg_weight_kg", markers=True, title="Avg Weight by Week"))
+        row.append(_weekly_chart(weekly_f[["week_number", "avg_weight_kg"]], "avg_weight_kg", "Avg Weight by Week", "line"))
     if "avg_steps" in weekly_f.columns and weekly_f["avg_steps"].notna().any():
-        row.append(px.bar(weekly_f, x="week_number", y="avg_steps", title="Avg Steps by Week"))
+        row.append(_weekly_chart(weekly_f[["week_number", "avg_steps"]], "avg_steps", "Avg Steps by Week", "bar"))
     if row:
         cols = st.columns(len(row))
         for ci, fig in zip(cols, row):
@@ -247,9 +264,9 @@ if not weekly_f.empty:
 
     row = []
     if show_weekly_loss and "weekly_weight_loss" in weekly_f.columns and weekly_f["weekly_weight_loss"].notna().any():
-        row.append(px.bar(weekly_f, x="week_number", y="weekly_weight_loss", title="Weekly Weight Change (kg)"))
+        row.append(_weekly_chart(weekly_f[["week_number", "weekly_weight_loss"]], "weekly_weight_loss", "Weekly Weight Change (kg)", "bar"))
     if "avg_km_calc" in weekly_f.columns and weekly_f["avg_km_calc"].notna().any():
-        row.append(px.line(weekly_f, x="week_number", y="avg_km_calc", markers=True, title="Avg KM by Week (derived)"))
+        row.append(_weekly_chart(weekly_f[["week_number", "avg_km_calc"]], "avg_km_calc", "Avg KM by Week (derived)", "line"))
     if row:
         cols = st.columns(len(row))
         for ci, fig in zip(cols, row):
@@ -292,17 +309,24 @@ if 'expenses_df' in locals() and expenses_df is not None and not expenses_df.emp
 
     by_cat = expm.get("by_category") if isinstance(expm, dict) else None
     if isinstance(by_cat, pd.DataFrame) and not by_cat.empty:
-        bc = by_cat.copy()
-        fig_c = px.pie(bc, names="category", values="amount", title="Expenses by Category")
+        # top-10 categories, long tail folded into "Other"; a bar renders far cheaper than a pie
+        bc = by_cat.nlargest(10, "amount")
+        rest = by_cat.drop(bc.index)
+        if not rest.empty:
+            bc = pd.concat([bc, pd.DataFrame({"category": ["Other"], "amount": [rest["amount"].sum()]})])
+            bc = bc.groupby("category", as_index=False, dropna=False)["amount"].sum()
+        fig_c = px.bar(bc.sort_values("amount"), x="amount", y="category", orientation="h", title="Expenses by Category")
         col_cat.plotly_chart(fig_c, use_container_width=True)
 
 # ---------- Tables ----------
+# Collapsed, height-limited expanders: fixed heights let the grid virtualize rows
+# instead of laying out thousands.
 if show_tables:
-    st.subheader("Daily Data (raw)")
-    st.dataframe(daily_raw.sort_values("date"), use_container_width=True)
-    st.subheader("Weekly Data")
-    wk_tbl = weekly.copy()
-    if "week_number" in wk_tbl.columns:
-        wk_tbl["week_number"] = pd.to_numeric(wk_tbl["week_number"], errors="coerce")
-        wk_tbl = wk_tbl.sort_values("week_number")
-    st.dataframe(wk_tbl, use_container_width=True)
+    with st.expander("Daily Data (raw)"):
+        st.dataframe(daily_raw.sort_values("date").reset_index(drop=True), use_container_width=True, height=400, hide_index=True)
+    with st.expander("Weekly Data"):
+        wk_tbl = weekly.copy()
+        if "week_number" in wk_tbl.columns:
+            wk_tbl["week_number"] = pd.to_numeric(wk_tbl["week_number"], errors="coerce")
+            wk_tbl = wk_tbl.sort_values("week_number")
+        st.dataframe(wk_tbl, use_container_width=True, height=400, hide_index=True)
@@ -1,27 +1,58 @@
 import streamlit as st
 import pandas as pd
 from datetime import date, timedelta
+from functools import lru_cache
 from sqlmodel import select
-from db import get_session
-from models import User, Week, DailyMetric, Measurement, Wellbeing, Adherence
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from db import cached_session, current_user
+from utils import steps_to_km_scalar
+from models import Week, DailyMetric, Measurement, Wellbeing, Adherence
 
 st.set_page_config(page_title="📝 Data Entry", page_icon="📝", layout="wide")
 st.title("📝 Data Entry")
 
 # ---------- helpers ----------
-def steps_to_km(steps):
-    s = pd.to_numeric(steps, errors="coerce")
-    return float((s * 8.0) / (1780.0 * 5.0)) if pd.notna(s) else None
-
+@lru_cache(maxsize=256)
 def monday_start(d: date) -> date:
     return d - timedelta(days=d.weekday())
 
+def _find_week(sess, user_id: int, start: date) -> Week | None:
+    # oldest row first, so legacy duplicate weeks resolve the same way the CSV import does
+    return sess.exec(
+        select(Week).where(Week.user_id == user_id, Week.start_date == start).order_by(Week.id),
+        execution_options={"populate_existing": True},
+    ).first()
+
 def get_or_create_week(sess, user_id: int, d: date) -> Week:
     start = monday_start(d)
+    # An existing week is a plain read; only a missing one takes the write lock.
+    wk = _find_week(sess, user_id, start)
+    if wk is None:
+        # Insert with the next week number; DO NOTHING if another session created it meanwhile
+        next_num = (
+            select(func.coalesce(func.max(Week.week_number), 0) + 1)
+            .where(Week.user_id == user_id)
+            .scalar_subquery()
+        )
+        stmt = sqlite_insert(Week).values(user_id=user_id, week_number=next_num, start_date=start)
+        try:
+            sess.execute(stmt.on_conflict_do_nothing(index_elements=["user_id", "start_date"]))
+        except OperationalError:
+            # DB predates the unique index (duplicate legacy weeks): use the lookup path
+            sess.rollback()
+            return _get_or_create_week_legacy(sess, user_id, start)
+        wk = _find_week(sess, user_id, start)
+    sess.commit()  # also ends the read transaction on the long-lived session
+    return wk
+
+def _get_or_create_week_legacy(sess, user_id: int, start: date) -> Week:
     wk = sess.exec(
         select(Week).where(Week.user_id == user_id, Week.start_date == start)
     ).first()
     if wk:
+        sess.commit()  # end the read transaction
         return wk
     # create new week with next number
     last = sess.exec(
@@ -34,9 +65,20 @@ def get_or_create_week(sess, user_id: int, d: date) -> Week:
     sess.refresh(wk)
     return wk
 
+def upsert_weekly(sess, model_cls, user_id: int, week_id: int, **values) -> None:
+    """Insert or update the single Measurement/Wellbeing/Adherence row for a week in one statement."""
+    stmt = sqlite_insert(model_cls).values(user_id=user_id, week_id=week_id, **values)
+    sess.execute(stmt.on_conflict_do_update(index_elements=["week_id"], set_=values))
+
+@st.cache_data(ttl=5, show_spinner=False)
+def _week_preview(user_id: int, day_iso: str) -> tuple[int, int, date]:
+    """(id, week_number, start_date) for the week containing day_iso; display-only reruns skip the query."""
+    wk = get_or_create_week(cached_session(), user_id, date.fromisoformat(day_iso))
+    return wk.id, wk.week_number, wk.start_date
+
 # ---------- load user ----------
-with get_session() as sess:
-    user = sess.exec(select(User)).first()
+sess = cached_session()
+user = current_user()
 
 tab1, tab2, tab3 = st.tabs(["Daily", "Weekly check-in", "Photos"])
 
@@ -47,12 +89,12 @@ with tab1:
     weight = st.number_input("Weight (kg)", min_value=0.0, step=0.1, format="%.1f")
     steps  = st.number_input("Steps", min_value=0, step=100)
     # KM is hidden & derived
-    km_val = steps_to_km(steps)
+    km_val = steps_to_km_scalar(steps)
 
     if st.button("Save daily entry"):
-        with get_session() as sess:
+        try:
             wk = get_or_create_week(sess, user.id, d)
-            wk_num = wk.week_number          # capture primitives BEFORE session closes
+            wk_num = wk.week_number          # capture primitives BEFORE the next commit expires them
             wk_start = wk.start_date
 
             dm = DailyMetric(
@@ -65,6 +107,10 @@ with tab1:
             )
             sess.add(dm)
             sess.commit()
+        except Exception:
+            sess.rollback()
+            raise
+        st.cache_data.clear()  # refresh cached Dashboard loaders
 
         st.success(f"Saved daily entry for {d} (Week #{wk_num}, start {wk_start}).")
 
@@ -72,9 +118,8 @@ with tab1:
 with tab2:
     st.subheader("Weekly check-in (auto week from chosen date)")
     wd = st.date_input("Any date in the week", value=date.today())
-    with get_session() as sess:
-        wk = get_or_create_week(sess, user.id, wd)
-    st.caption(f"Auto week: **Week {wk.week_number}**, starting **{wk.start_date} (Mon)**")
+    wk_id, wk_num, wk_start = _week_preview(user.id, wd.isoformat())
+    st.caption(f"Auto week: **Week {wk_num}**, starting **{wk_start} (Mon)**")
 
     c1, c2, c3 = st.columns(3)
     with c1:
@@ -93,59 +138,22 @@ with tab2:
         workout = st.slider("Workout adherence (0→10)", 0, 10, 10)
 
     if st.button("Save weekly check-in"):
-        # Capture primitives so we don't touch a detached ORM object later
-        wk_id = int(wk.id)
-        wk_num = int(wk.week_number)
-
-        with get_session() as sess:
-            # Measurement (upsert)
-            row = sess.exec(
-                select(Measurement).where(
-                    Measurement.user_id == user.id,
-                    Measurement.week_id == wk_id
-                )
-            ).first()
-            if not row:
-                row = Measurement(user_id=user.id, week_id=wk_id)
-            row.r_biceps_in = r_bi or None
-            row.l_biceps_in = l_bi or None
-            row.chest_in = chest or None
-            row.r_thigh_in = r_th or None
-            row.l_thigh_in = l_th or None
-            row.waist_navel_in = waist or None
-            sess.add(row)
-
-            # Wellbeing (upsert)
-            wb = sess.exec(
-                select(Wellbeing).where(
-                    Wellbeing.user_id == user.id,
-                    Wellbeing.week_id == wk_id
-                )
-            ).first()
-            if not wb:
-                wb = Wellbeing(user_id=user.id, week_id=wk_id)
-            wb.sleep_issues = int(sleep)
-            wb.hunger_issues = int(hunger)
-            wb.stress_issues = int(stress)
-            sess.add(wb)
-
-            # Adherence (upsert)
-            ad = sess.exec(
-                select(Adherence).where(
-                    Adherence.user_id == user.id,
-                    Adherence.week_id == wk_id
-                )
-            ).first()
-            if not ad:
-                # BUG in your snippet fixed here: use week_id=wk_id (not 'week_id == wk_id')
-                ad = Adherence(user_id=user.id, week_id=wk_id)
-            ad.diet_score = int(diet)
-            ad.workout_score = int(workout)
-            sess.add(ad)
-
+        try:
+            # One INSERT ... ON CONFLICT(week_id) DO UPDATE per weekly table (week_id is unique)
+            upsert_weekly(sess, Measurement, user.id, wk_id,
+                          r_biceps_in=r_bi or None, l_biceps_in=l_bi or None, chest_in=chest or None,
+                          r_thigh_in=r_th or None, l_thigh_in=l_th or None, waist_navel_in=waist or None)
+            upsert_weekly(sess, Wellbeing, user.id, wk_id,
+                          sleep_issues=int(sleep), hunger_issues=int(hunger), stress_issues=int(stress))
+            upsert_weekly(sess, Adherence, user.id, wk_id,
+                          diet_score=int(diet), workout_score=int(workout))
             sess.commit()
+        except Exception:
+            sess.rollback()
+            raise
+        st.cache_data.clear()  # refresh cached Dashboard loaders
 
-        # Use the captured primitives (not the detached 'wk' object)
+        # Use the cached primitives (not an ORM 'wk' object)
         st.success(f"Saved weekly check-in for Week {wk_num}.")
 
 # ==== PHOTOS (placeholder) ====
@@ -6,15 +6,16 @@ try:
 except Exception:
     import_progress_sheet = None  # Google Sheets importer not available
 
+import numpy as np
 import pandas as pd
 from datetime import date, timedelta
-from dateutil.parser import parse as parse_date
 from sqlmodel import select
-from sqlalchemy import delete as sqla_delete
-from db import get_session
-from models import User, DailyMetric, Week, Measurement, Wellbeing, Adherence
+from sqlalchemy import delete as sqla_delete, func, insert, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from db import get_session, current_user, DB_PATH
+from models import DailyMetric, Week, Measurement, Wellbeing, Adherence
 import io, os, shutil, sqlite3
-from utils import load_css
+from utils import load_css, steps_to_km_series
 
 
 # optional CSS (safe after set_page_config)
@@ -46,86 +47,181 @@ tmpl = pd.DataFrame({
 })
 st.download_button("Download CSV Template", data=tmpl.to_csv(index=False), file_name="progress_template.csv")
 
+def _csv_lines(mask: pd.Series, limit: int = 5) -> str:
+    """1-based CSV line numbers (header is line 1) of the first flagged rows."""
+    lines = [str(i + 2) for i in mask[mask].index[:limit]]
+    return ", ".join(lines) + (", …" if int(mask.sum()) > limit else "")
+
 uploaded = st.file_uploader("Upload CSV", type=["csv"])
 if uploaded and st.button("Import"):
-    df = pd.read_csv(uploaded)
+    # Known numeric columns parse straight to float64 in the C reader (blank -> NaN);
+    # a file with stray text in them falls back to the untyped read + to_numeric below.
+    # Only empty cells count as missing: text like "n/a" is reported, not read as blank.
+    numeric_cols = set(tmpl.columns) - {"date", "start_date"}
+    na = {"na_values": [""], "keep_default_na": False}
+    header = pd.read_csv(uploaded, nrows=0).columns
+    uploaded.seek(0)
+    try:
+        df = pd.read_csv(uploaded, dtype={c: "float64" for c in header if c.strip().lower() in numeric_cols}, **na)
+    except ValueError:
+        uploaded.seek(0)
+        df = pd.read_csv(uploaded, **na)
     # Normalize column names
     df.columns = [c.strip().lower() for c in df.columns]
     required = ["date","weight_kg","steps","week_number","start_date"]
     if not set(required).issubset(set(df.columns)):
         st.error(f"Missing columns. Required: {required}")
     else:
-        n_daily, n_week = 0, 0
-        with get_session() as sess:
-            user = sess.exec(select(User)).first()
-            # Create or upsert weeks
-            for _, row in df.iterrows():
-                start = parse_date(str(row["start_date"])).date()
-                wk = sess.exec(select(Week).where(Week.user_id==user.id, Week.start_date==start)).first()
-                if not wk:
-                    wk = Week(user_id=user.id, week_number=int(row["week_number"]), start_date=start)
-                    sess.add(wk); sess.commit(); sess.refresh(wk); n_week += 1
-                # daily
-                d = parse_date(str(row["date"])).date()
-                dm = sess.exec(select(DailyMetric).where(DailyMetric.user_id==user.id, DailyMetric.date==d)).first()
-                if not dm: dm = DailyMetric(user_id=user.id, date=d, week_id=wk.id)
-                dm.weight_kg = float(row["weight_kg"]) if not pd.isna(row["weight_kg"]) else None
-                dm.steps = int(row["steps"]) if not pd.isna(row["steps"]) else None
-                # keep KM derived from steps
-                dm.run_km = ((dm.steps * 8.0) / (1780.0 * 5.0)) if dm.steps is not None else None
-                dm.week_id = wk.id
-                sess.add(dm); sess.commit(); n_daily += 1
-                # Optional weekly rows if present
-                def assign_weekly(model_cls, fields):
-                    existing = sess.exec(select(model_cls).where(model_cls.user_id==user.id, model_cls.week_id==wk.id)).first()
-                    if not existing:
-                        existing = model_cls(user_id=user.id, week_id=wk.id)
-                    changed = False
+        # Parse dates and numbers column-wise once, then refuse the whole file if anything
+        # didn't parse: a bad date would drop its row and stray text would overwrite a
+        # stored value with NULL, so nothing is written until every value is usable.
+        problems = []
+        for c in ("date", "start_date"):
+            parsed = pd.to_datetime(df[c], format="mixed", errors="coerce")
+            bad = parsed.isna()
+            if bad.any():
+                problems.append(f"`{c}`: {int(bad.sum())} missing or unparseable value(s), CSV line(s) {_csv_lines(bad)}")
+            df[c] = parsed.dt.date
+        for c in [c for c in df.columns if c in numeric_cols]:
+            parsed = pd.to_numeric(df[c], errors="coerce")
+            blank = df[c].isna() | df[c].astype(str).str.strip().eq("")
+            bad = parsed.isna() & ~blank
+            if bad.any():
+                problems.append(f"`{c}`: {int(bad.sum())} non-numeric value(s), CSV line(s) {_csv_lines(bad)}")
+            df[c] = parsed
+        if problems:
+            st.error("Nothing was imported. Fix these values in the CSV and try again:\n\n"
+                     + "\n".join(f"- {p}" for p in problems))
+        else:
+            # One transaction for the whole import: committed on exit, rolled back on any error,
+            # so a bad row never leaves a half-imported CSV behind.
+            user = current_user()
+            with get_session() as sess, sess.begin():
+                # Weeks: one lookup for the user's weeks, one bulk INSERT for the missing ones.
+                # Ordered by id desc so the oldest row wins for legacy duplicate start dates.
+                week_q = select(Week.start_date, Week.id).where(Week.user_id==user.id).order_by(Week.id.desc())
+                week_ids = dict(sess.exec(week_q).all())
+                new_weeks = df.drop_duplicates("start_date")
+                new_weeks = new_weeks[~new_weeks["start_date"].isin(list(week_ids))]
+                if len(new_weeks):
+                    sess.execute(insert(Week), [
+                        {"user_id": user.id, "week_number": int(n), "start_date": s}
+                        for s, n in zip(new_weeks["start_date"], new_weeks["week_number"])
+                    ])
+                    week_ids.update(sess.exec(week_q.where(Week.start_date.in_(list(new_weeks["start_date"])))).all())
+                n_week = len(new_weeks)
+                df["week_id"] = df["start_date"].map(week_ids)
+
+                # daily: last CSV row per date wins; split into bulk INSERT / bulk UPDATE by id
+                daily = df.drop_duplicates("date", keep="last")
+                steps = pd.to_numeric(daily["steps"], errors="coerce")
+                rows = pd.DataFrame({
+                    "user_id": user.id,
+                    "date": daily["date"],
+                    "week_id": daily["week_id"],
+                    "weight_kg": pd.to_numeric(daily["weight_kg"], errors="coerce"),
+                    "steps": np.trunc(steps).astype("Int64"),
+                    # keep KM derived from steps
+                    "run_km": steps_to_km_series(np.trunc(steps)),
+                })
+                rows = rows.astype(object).where(rows.notna(), None)
+                existing = dict(sess.exec(
+                    select(DailyMetric.date, DailyMetric.id).where(DailyMetric.user_id==user.id).order_by(DailyMetric.id.desc())
+                ).all())
+                ids = rows["date"].map(existing)
+                is_new = ids.isna().to_numpy()
+                if is_new.any():
+                    sess.execute(insert(DailyMetric), rows[is_new].to_dict("records"))
+                if (~is_new).any():
+                    sess.execute(update(DailyMetric), rows[~is_new].assign(id=ids[~is_new].astype(int)).to_dict("records"))
+                n_daily = len(rows)
+
+                # Optional weekly rows if present: last non-blank value per week and field, then
+                # one INSERT ... ON CONFLICT(week_id) per table; blank cells keep the stored value
+                for model, fields in (
+                    (Measurement, ["r_biceps_in","l_biceps_in","chest_in","r_thigh_in","l_thigh_in","waist_navel_in"]),
+                    (Wellbeing, ["sleep_issues","hunger_issues","stress_issues"]),
+                    (Adherence, ["diet_score","workout_score"]),
+                ):
+                    fields = [f for f in fields if f in df.columns]
+                    if not fields:
+                        continue
+                    vals = pd.DataFrame({"week_id": df["week_id"]})
                     for f in fields:
-                        if f in df.columns and f in row and not pd.isna(row[f]):
-                            setattr(existing, f, float(row[f]) if "score" not in f and "issues" not in f else int(row[f]))
-                            changed = True
-                    if changed:
-                        sess.add(existing); sess.commit()
-                assign_weekly(Measurement, ["r_biceps_in","l_biceps_in","chest_in","r_thigh_in","l_thigh_in","waist_navel_in"])
-                assign_weekly(Wellbeing, ["sleep_issues","hunger_issues","stress_issues"])
-                assign_weekly(Adherence, ["diet_score","workout_score"])
-        st.success(f"Imported {n_daily} daily rows; created {n_week} weeks.")
-
-# helper: make export compatible with both SQLModel/Pydantic v1 & v2
-def _row_to_dict(obj):
-    if hasattr(obj, "model_dump"):
-        return obj.model_dump()
-    if hasattr(obj, "dict"):
-        return obj.dict()
-    # fallback: use __dict__ without private attrs
-    return {k: v for k, v in obj.__dict__.items() if not k.startswith("_")}
+                        v = pd.to_numeric(df[f], errors="coerce")
+                        vals[f] = np.trunc(v) if f.endswith(("issues","score")) else v
+                    vals = vals.groupby("week_id")[fields].last().dropna(how="all").reset_index()
+                    if vals.empty:
+                        continue
+                    for f in fields:
+                        if f.endswith(("issues","score")):
+                            vals[f] = vals[f].astype("Int64")
+                    vals.insert(0, "user_id", user.id)
+                    vals = vals.astype(object).where(vals.notna(), None)
+                    stmt = sqlite_insert(model)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=["week_id"],
+                        set_={f: func.coalesce(stmt.excluded[f], getattr(model, f)) for f in fields},
+                    )
+                    sess.execute(stmt, vals.to_dict("records"))
+            st.cache_data.clear()
+            st.success(f"Imported {n_daily} daily rows; created {n_week} weeks.")
 
 st.subheader("Export / Backup")
 col1, col2 = st.columns(2)
 with col1:
-    if st.button("Export all tables to CSV"):
+    export_fmt = st.radio("Export format", ["Parquet", "CSV (legacy)"], horizontal=True)
+    if st.button("Export all tables"):
         from models import DailyMetric, Week, Measurement, Wellbeing, Adherence
         with get_session() as sess:
             import tempfile, zipfile
+            # straight from the DB cursor into columns; no ORM objects or per-row dicts
+            conn = sess.connection()
             tables = {
-                "daily_metrics.csv": pd.DataFrame([_row_to_dict(r) for r in sess.exec(select(DailyMetric)).all()]),
-                "weeks.csv": pd.DataFrame([_row_to_dict(r) for r in sess.exec(select(Week)).all()]),
-                "measurements.csv": pd.DataFrame([_row_to_dict(r) for r in sess.exec(select(Measurement)).all()]),
-                "wellbeing.csv": pd.DataFrame([_row_to_dict(r) for r in sess.exec(select(Wellbeing)).all()]),
-                "adherence.csv": pd.DataFrame([_row_to_dict(r) for r in sess.exec(select(Adherence)).all()]),
+                name: pd.read_sql_query(model.__table__.select(), conn)
+                for name, model in {
+                    "daily_metrics": DailyMetric,
+                    "weeks": Week,
+                    "measurements": Measurement,
+                    "wellbeing": Wellbeing,
+                    "adherence": Adherence,
+                }.items()
             }
             zbuf = io.BytesIO()
-            with zipfile.ZipFile(zbuf, "w", zipfile.ZIP_DEFLATED) as z:
-                for name, df in tables.items():
-                    z.writestr(name, df.to_csv(index=False))
-            st.download_button("Download CSV bundle", data=zbuf.getvalue(), file_name="fitness_export.zip")
+            if export_fmt == "Parquet":
+                # parquet is already compressed column-wise; store it rather than deflate it again
+                with zipfile.ZipFile(zbuf, "w", zipfile.ZIP_STORED) as z:
+                    for name, df in tables.items():
+                        pbuf = io.BytesIO()
+                        df.to_parquet(pbuf, engine="pyarrow", compression="zstd", index=False)
+                        z.writestr(f"{name}.parquet", pbuf.getvalue())
+                st.download_button("Download Parquet bundle", data=zbuf.getvalue(), file_name="fitness_export.zip")
+            else:
+                with zipfile.ZipFile(zbuf, "w", zipfile.ZIP_DEFLATED) as z:
+                    for name, df in tables.items():
+                        z.writestr(f"{name}.csv", df.to_csv(index=False))
+                st.download_button("Download CSV bundle", data=zbuf.getvalue(), file_name="fitness_export.zip")
 with col2:
+    compact = st.checkbox("Compact backup (VACUUM INTO: smaller file, slower)", value=False)
     if st.button("Backup SQLite DB"):
-        path = os.path.join("data","fitness.db")
-        if os.path.exists(path):
-            with open(path,"rb") as f:
-                st.download_button("Download DB", data=f.read(), file_name="fitness.db")
+        if os.path.exists(DB_PATH):
+            # Online backup API: a consistent snapshot (WAL contents included) even while
+            # other sessions write, copied 1024 pages per step instead of the default 5.
+            import tempfile
+            with tempfile.TemporaryDirectory() as tmpdir:
+                dst_path = os.path.join(tmpdir, "fitness.db")
+                src = sqlite3.connect(DB_PATH)
+                try:
+                    if compact:
+                        src.execute("VACUUM INTO ?", (dst_path,))
+                    else:
+                        dst = sqlite3.connect(dst_path)
+                        src.backup(dst, pages=1024)
+                        dst.close()
+                finally:
+                    src.close()
+                with open(dst_path, "rb") as f:
+                    st.download_button("Download DB", data=f.read(), file_name="fitness.db")
         else:
             st.warning("No DB found yet.")
  
@@ -149,29 +245,27 @@ with st.expander("Delete data by date range or week numbers", expanded=False):
         # Preview counts
         if st.button("Preview impact", key="preview_by_date"):
             with get_session() as sess:
+                in_range = (DailyMetric.date >= d_from, DailyMetric.date <= d_to)
                 # Daily rows in range
-                q_daily = sess.exec(
-                    select(DailyMetric).where(DailyMetric.date >= d_from, DailyMetric.date <= d_to)
-                ).all()
-                st.info(f"Daily rows to delete: {len(q_daily)}")
+                n_daily = sess.exec(select(func.count()).select_from(DailyMetric).where(*in_range)).one()
+                st.info(f"Daily rows to delete: {n_daily}")
 
                 # Weeks touched
-                touched_week_ids = sorted({dm.week_id for dm in q_daily if dm.week_id is not None})
+                touched_week_ids = sorted(sess.exec(
+                    select(DailyMetric.week_id).where(*in_range, DailyMetric.week_id.is_not(None)).distinct()
+                ).all())
                 st.write(f"Weeks touched: {touched_week_ids if touched_week_ids else 'None'}")
 
                 if also_delete_weekly and touched_week_ids:
-                    # Which of those weeks would become empty (no dailies left after deletion)
-                    empty_weeks = []
-                    for wid in touched_week_ids:
-                        # remaining dailies outside the range
-                        remaining = sess.exec(
-                            select(DailyMetric).where(
-                                DailyMetric.week_id == wid,
-                                (DailyMetric.date < d_from) | (DailyMetric.date > d_to)
-                            )
-                        ).all()
-                        if len(remaining) == 0:
-                            empty_weeks.append(wid)
+                    # Which of those weeks would become empty (no dailies left after deletion):
+                    # one grouped count of the dailies outside the range
+                    remaining = dict(sess.exec(
+                        select(DailyMetric.week_id, func.count()).where(
+                            DailyMetric.week_id.in_(touched_week_ids),
+                            (DailyMetric.date < d_from) | (DailyMetric.date > d_to)
+                        ).group_by(DailyMetric.week_id)
+                    ).all())
+                    empty_weeks = [wid for wid in touched_week_ids if remaining.get(wid, 0) == 0]
                     st.write(f"Weeks that would be fully removed (and thus weekly check-ins eligible for deletion): {empty_weeks if empty_weeks else 'None'}")
 
         confirm = st.text_input("Type DELETE to confirm", "")
@@ -179,38 +273,39 @@ with st.expander("Delete data by date range or week numbers", expanded=False):
             if confirm != "DELETE":
                 st.error("Please type DELETE to confirm.")
             else:
-                with get_session() as sess:
+                # all statements in one transaction: a single commit, rolled back on error
+                with get_session() as sess, sess.begin():
                     # Collect affected weeks before deletion
-                    q_daily = sess.exec(
-                        select(DailyMetric).where(DailyMetric.date >= d_from, DailyMetric.date <= d_to)
-                    ).all()
-                    touched_week_ids = sorted({dm.week_id for dm in q_daily if dm.week_id is not None})
+                    touched_week_ids = sorted(sess.exec(
+                        select(DailyMetric.week_id).where(
+                            DailyMetric.date >= d_from, DailyMetric.date <= d_to, DailyMetric.week_id.is_not(None)
+                        ).distinct()
+                    ).all())
 
                     # Delete daily metrics in range
                     sess.exec(
                         sqla_delete(DailyMetric).where(DailyMetric.date >= d_from, DailyMetric.date <= d_to)
                     )
-                    sess.commit()
 
                     if also_delete_weekly and touched_week_ids:
                         # Determine weeks that became empty
-                        empty_weeks = []
-                        for wid in touched_week_ids:
-                            remaining = sess.exec(select(DailyMetric).where(DailyMetric.week_id == wid)).all()
-                            if len(remaining) == 0:
-                                empty_weeks.append(wid)
+                        remaining = dict(sess.exec(
+                            select(DailyMetric.week_id, func.count())
+                            .where(DailyMetric.week_id.in_(touched_week_ids))
+                            .group_by(DailyMetric.week_id)
+                        ).all())
+                        empty_weeks = [wid for wid in touched_week_ids if remaining.get(wid, 0) == 0]
 
                         if empty_weeks:
                             # Remove weekly one-to-ones for empty weeks
                             sess.exec(sqla_delete(Measurement).where(Measurement.week_id.in_(empty_weeks)))
                             sess.exec(sqla_delete(Wellbeing).where(Wellbeing.week_id.in_(empty_weeks)))
                             sess.exec(sqla_delete(Adherence).where(Adherence.week_id.in_(empty_weeks)))
-                            sess.commit()
 
                             if delete_empty_weeks:
                                 sess.exec(sqla_delete(Week).where(Week.id.in_(empty_weeks)))
-                                sess.commit()
 
+                st.cache_data.clear()
                 st.success("Deletion completed. Check the dashboard.")
 
     else:
@@ -234,7 +329,9 @@ with st.expander("Delete data by date range or week numbers", expanded=False):
 
                 daily_count = 0
                 if wids:
-                    daily_count = len(sess.exec(select(DailyMetric).where(DailyMetric.week_id.in_(wids))).all())
+                    daily_count = sess.exec(
+                        select(func.count()).select_from(DailyMetric).where(DailyMetric.week_id.in_(wids))
+                    ).one()
                 st.write(f"Daily rows to delete: {daily_count}")
 
         confirm2 = st.text_input("Type DELETE to confirm", "", key="confirm_week")
@@ -242,7 +339,7 @@ with st.expander("Delete data by date range or week numbers", expanded=False):
             if confirm2 != "DELETE":
                 st.error("Please type DELETE to confirm.")
             else:
-                with get_session() as sess:
+                with get_session() as sess, sess.begin():
                     week_rows = sess.exec(
                         select(Week).where(Week.week_number >= wk_from, Week.week_number <= wk_to)
                     ).all()
@@ -251,18 +348,16 @@ with st.expander("Delete data by date range or week numbers", expanded=False):
                     if wids:
                         # Delete dailies
                         sess.exec(sqla_delete(DailyMetric).where(DailyMetric.week_id.in_(wids)))
-                        sess.commit()
 
                         if also_delete_weekly2:
                             sess.exec(sqla_delete(Measurement).where(Measurement.week_id.in_(wids)))
                             sess.exec(sqla_delete(Wellbeing).where(Wellbeing.week_id.in_(wids)))
                             sess.exec(sqla_delete(Adherence).where(Adherence.week_id.in_(wids)))
-                            sess.commit()
 
                         if delete_weeks2:
                             sess.exec(sqla_delete(Week).where(Week.id.in_(wids)))
-                            sess.commit()
 
+                st.cache_data.clear()
                 st.success("Deletion completed for selected weeks.")
 
 if import_progress_sheet:
@@ -270,17 +365,21 @@ if import_progress_sheet:
 
     DEFAULT_ID = "1DI_3qReYN05ouvBx6bv161UKk233GrYh2vLi5H-tOVI"
 
+    @st.cache_data(ttl=300, show_spinner=False)
+    def _list_worksheets(sid: str) -> list[str]:
+        """Worksheet titles for a spreadsheet; the network round trip runs at most every 5 min per id."""
+        import gspread
+        gc = gspread.service_account_from_dict(st.secrets["gcp_service_account"])
+        return [ws.title for ws in gc.open_by_key(sid).worksheets()]
+
     with st.form("import_progress_sheet"):
         sid = st.text_input("Spreadsheet ID", value=DEFAULT_ID)
 
-        # Try to populate worksheet options dynamically
-        import gspread
+        # Try to populate worksheet options dynamically (cached per sheet id)
         ws_options = []
         try:
             if "gcp_service_account" in st.secrets and sid:
-                gc = gspread.service_account_from_dict(st.secrets["gcp_service_account"])
-                sh = gc.open_by_key(sid)
-                ws_options = [ws.title for ws in sh.worksheets()]  # should list "Check-in"
+                ws_options = _list_worksheets(sid)  # should list "Check-in"
         except Exception:
             pass
 
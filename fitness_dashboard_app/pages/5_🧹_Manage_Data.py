@@ -1,25 +1,24 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-from sqlmodel import select
-from db import get_session
-from models import User, DailyMetric, Week, Measurement, Wellbeing, Adherence
+from sqlalchemy import delete as sqla_delete, select as sa_select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from db import get_session, current_user
+from utils import load_daily_df, steps_to_km_series
+from models import DailyMetric, Week, Measurement, Wellbeing, Adherence
 
 st.set_page_config(page_title="🧹 Manage Data", page_icon="🧹", layout="wide")
 st.title("🧹 Manage Data")
 
-def to_df(rows):
-    return pd.DataFrame([getattr(r, "model_dump", getattr(r, "dict", lambda: r.__dict__))() for r in rows])
-
-with get_session() as sess:
-    user = sess.exec(select(User)).first()
+user = current_user()
 
 tab1, tab2 = st.tabs(["Daily", "Weekly"])
 
 # ---- DAILY ----
 with tab1:
     with get_session() as sess:
-        rows = sess.exec(select(DailyMetric).where(DailyMetric.user_id==user.id)).all()
-    df = to_df(rows)
+        df = load_daily_df(sess, user.id)
     if df.empty:
         st.info("No daily entries yet.")
     else:
@@ -41,59 +40,51 @@ with tab1:
         c1, c2 = st.columns(2)
         with c1:
             if st.button("💾 Save changes"):
+                rows = edited.dropna(subset=["id"])
+                steps = np.trunc(pd.to_numeric(rows["steps"], errors="coerce"))
+                upd = pd.DataFrame({
+                    "id": rows["id"].astype(int),
+                    "date": pd.to_datetime(rows["date"]).dt.date,
+                    "week_id": pd.to_numeric(rows["week_id"], errors="coerce").astype("Int64"),
+                    "weight_kg": pd.to_numeric(rows["weight_kg"], errors="coerce"),
+                    "steps": steps.astype("Int64"),
+                    # 🔁 keep KM derived from steps
+                    "run_km": steps_to_km_series(steps),
+                })
+                upd = upd.astype(object).where(upd.notna(), None)
+                # a blank week_id leaves the stored one untouched
+                updates = [
+                    {k: v for k, v in r.items() if not (k == "week_id" and v is None)}
+                    for r in upd.to_dict("records")
+                ]
                 with get_session() as sess:
-                    for _, r in edited.iterrows():
-                        dm = sess.get(DailyMetric, int(r["id"]))
-                        if not dm:
-                            continue
-
-                        dm.date = pd.to_datetime(r["date"]).date()
-                        if pd.notna(r.get("week_id")):
-                            dm.week_id = int(r["week_id"])
-
-                        dm.weight_kg = float(r["weight_kg"]) if pd.notna(r.get("weight_kg")) else None
-                        dm.steps = int(r["steps"]) if pd.notna(r.get("steps")) else None
-
-                        # 🔁 keep KM derived from steps
-                        if dm.steps is not None:
-                            dm.run_km = (dm.steps * 8.0) / (1780.0 * 5.0)
-                        else:
-                            dm.run_km = None
-
-                        sess.add(dm)
+                    # one executemany UPDATE ... WHERE id=? instead of a get() + flush per row
+                    sess.execute(update(DailyMetric), updates)
                     sess.commit()
+                st.cache_data.clear()
                 st.success("Daily changes saved.")
         with c2:
             if st.button("🗑️ Delete selected"):
-                ids = edited.loc[edited["🗑️ delete"] == True, "id"].tolist()
+                ids = [int(i) for i in edited.loc[edited["🗑️ delete"] == True, "id"].dropna()]
                 if not ids:
                     st.warning("Select at least one row.")
                 else:
                     with get_session() as sess:
-                        for i in ids:
-                            dm = sess.get(DailyMetric, int(i))
-                            if dm: sess.delete(dm)
+                        sess.exec(sqla_delete(DailyMetric).where(DailyMetric.id.in_(ids)))
                         sess.commit()
+                    st.cache_data.clear()
                     st.success(f"Deleted {len(ids)} row(s).")
 
 # ---- WEEKLY ----
 with tab2:
+    # one LEFT JOIN of the weeks with their (unique per week) check-in rows
+    cols = [Week.id.label("week_id"), Week.week_number, Week.start_date]
+    stmt = sa_select().select_from(Week)
+    for model in (Measurement, Wellbeing, Adherence):
+        cols += [c for c in model.__table__.columns if c.name not in ("id", "user_id", "week_id")]
+        stmt = stmt.outerjoin(model, (model.week_id == Week.id) & (model.user_id == user.id))
     with get_session() as sess:
-        weeks = sess.exec(select(Week).where(Week.user_id==user.id)).all()
-        meas  = sess.exec(select(Measurement).where(Measurement.user_id==user.id)).all()
-        wb    = sess.exec(select(Wellbeing).where(Wellbeing.user_id==user.id)).all()
-        adh   = sess.exec(select(Adherence).where(Adherence.user_id==user.id)).all()
-
-    w = to_df(weeks).rename(columns={"id":"week_id"}) if weeks else pd.DataFrame(columns=["week_id","week_number","start_date"])
-    m = to_df(meas) if meas else pd.DataFrame(columns=["week_id"])
-    wbdf = to_df(wb) if wb else pd.DataFrame(columns=["week_id"])
-    ad = to_df(adh) if adh else pd.DataFrame(columns=["week_id"])
-
-    out = w[["week_id","week_number","start_date"]] if not w.empty else pd.DataFrame(columns=["week_id","week_number","start_date"])
-    for frame in (m, wbdf, ad):
-        if not frame.empty:
-            frame = frame.drop(columns=[c for c in ["user_id","id"] if c in frame.columns])
-            out = out.merge(frame, on="week_id", how="left")
+        out = pd.read_sql_query(stmt.add_columns(*cols).where(Week.user_id == user.id), sess.connection())
 
     if out.empty:
         st.info("No weekly entries yet.")
@@ -112,35 +103,54 @@ with tab2:
         c1, c2 = st.columns(2)
         with c1:
             if st.button("💾 Save weekly changes"):
-                with get_session() as sess:
-                    for _, r in edited.iterrows():
-                        wk = sess.get(Week, int(r["week_id"]))
-                        if wk:
-                            wk.start_date = pd.to_datetime(r["start_date"]).date()
-                            sess.add(wk)
-                        def upsert(model, fields):
-                            row = sess.exec(select(model).where(model.user_id==user.id, model.week_id==int(r["week_id"]))).first()
-                            if not row: row = model(user_id=user.id, week_id=int(r["week_id"]))
-                            for f in fields:
-                                if f in edited.columns:
-                                    val = r.get(f)
-                                    setattr(row, f, None if pd.isna(val) else (int(val) if f.endswith(("issues","score")) else float(val)))
-                            sess.add(row)
-                        upsert(Measurement, ["r_biceps_in","l_biceps_in","chest_in","r_thigh_in","l_thigh_in","waist_navel_in"])
-                        upsert(Wellbeing, ["sleep_issues","hunger_issues","stress_issues"])
-                        upsert(Adherence, ["diet_score","workout_score"])
-                    sess.commit()
-                st.success("Weekly changes saved.")
+                week_ids = edited["week_id"].astype(int)
+                start_dates = pd.to_datetime(edited["start_date"]).dt.date
+                # every stored week is in the grid, so a start date used twice here would hit
+                # the (user_id, start_date) unique index
+                dup = start_dates[start_dates.duplicated(keep=False)]
+                if not dup.empty:
+                    st.error("Each week needs its own start date; used more than once: "
+                             + ", ".join(sorted({str(d) for d in dup})))
+                else:
+                    try:
+                        # one transaction: committed on exit, rolled back if any statement fails
+                        with get_session() as sess, sess.begin():
+                            sess.execute(update(Week), [
+                                {"id": wid, "start_date": d}
+                                for wid, d in zip(week_ids, start_dates)
+                            ])
+                            for model, fields in (
+                                (Measurement, ["r_biceps_in","l_biceps_in","chest_in","r_thigh_in","l_thigh_in","waist_navel_in"]),
+                                (Wellbeing, ["sleep_issues","hunger_issues","stress_issues"]),
+                                (Adherence, ["diet_score","workout_score"]),
+                            ):
+                                fields = [f for f in fields if f in edited.columns]
+                                vals = pd.DataFrame({"user_id": user.id, "week_id": week_ids})
+                                for f in fields:
+                                    v = pd.to_numeric(edited[f], errors="coerce")
+                                    vals[f] = np.trunc(v).astype("Int64") if f.endswith(("issues","score")) else v
+                                vals = vals.astype(object).where(vals.notna(), None)
+                                # one INSERT ... ON CONFLICT(week_id) per table instead of SELECT + add per week
+                                stmt = sqlite_insert(model)
+                                if fields:
+                                    stmt = stmt.on_conflict_do_update(index_elements=["week_id"], set_={f: stmt.excluded[f] for f in fields})
+                                else:
+                                    stmt = stmt.on_conflict_do_nothing(index_elements=["week_id"])
+                                sess.execute(stmt, vals.to_dict("records"))
+                    except IntegrityError:
+                        # e.g. a week added elsewhere since this grid was loaded
+                        st.error("Couldn’t save: a start date now matches another of your weeks. Nothing was changed.")
+                    else:
+                        st.cache_data.clear()
+                        st.success("Weekly changes saved.")
         with c2:
             if st.button("🗑️ Delete selected week rows (all weekly records)"):
-                ids = edited.loc[edited["🗑️ delete"] == True, "week_id"].tolist()
+                ids = [int(i) for i in edited.loc[edited["🗑️ delete"] == True, "week_id"]]
                 if not ids:
                     st.warning("Select at least one row.")
                 else:
-                    with get_session() as sess:
-                        for wid in ids:
-                            for model in (Measurement, Wellbeing, Adherence):
-                                row = sess.exec(select(model).where(model.user_id==user.id, model.week_id==int(wid))).first()
-                                if row: sess.delete(row)
-                        sess.commit()
+                    with get_session() as sess, sess.begin():
+                        for model in (Measurement, Wellbeing, Adherence):
+                            sess.exec(sqla_delete(model).where(model.user_id==user.id, model.week_id.in_(ids)))
+                    st.cache_data.clear()
                     st.success(f"Deleted records for {len(ids)} week(s).")
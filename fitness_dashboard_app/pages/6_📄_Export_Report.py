@@ -1,7 +1,10 @@
 # pages/6_📄_Export_Report.py
 import io
+import hashlib
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
+import numpy as np
 import pandas as pd
 
 # Try optional deps up front but don't crash the page
@@ -23,25 +26,44 @@ except Exception:
     A4 = canvas = ImageReader = cm = None
     _missing.append("reportlab")
 
-from sqlmodel import select
-from db import get_session
-from models import User
-from utils import load_daily_df, load_weekly_df, rolling_avg
+from db import current_user
+from utils import cached_daily_df, cached_weekly_df, rolling_avg, KM_PER_STEP
 
 st.set_page_config(page_title="📄 Export Report", page_icon="📄", layout="wide")
 st.title("📄 Export Progress Report")
 
-# --- helper ---
-def steps_to_km(s: pd.Series) -> pd.Series:
-    s = pd.to_numeric(s, errors="coerce")
-    return (s * 8.0) / (1780.0 * 5.0)
+@st.cache_data(ttl=60, show_spinner=False)
+def _prep(user_id: int, d_from: dt.date, d_to: dt.date) -> pd.DataFrame:
+    """Day-level frame for the range (same logic as dashboard); figures are rebuilt from it."""
+    d = cached_daily_df(user_id)[["date", "weight_kg", "steps"]].copy()
+    dates = pd.to_datetime(d["date"], errors="coerce").to_numpy("datetime64[ns]")
+    d["day"] = dates.astype("datetime64[D]").astype("datetime64[ns]")
+    day_arr = d["day"].to_numpy()
+    d = d.loc[(day_arr >= np.datetime64(d_from)) & (day_arr <= np.datetime64(d_to))].copy()
+    # numeric float64 columns only, so resample stays on its fast path
+    d["weight_kg"] = pd.to_numeric(d["weight_kg"], errors="coerce").astype("float64")
+    d["steps"] = pd.to_numeric(d["steps"], errors="coerce").astype("float64")
+    day = (
+        d.set_index("day")[["weight_kg", "steps"]]
+         .sort_index()
+         .resample("D")
+         .mean()
+         .reset_index()
+    )
+    day["km_calc"] = (day["steps"].to_numpy() * KM_PER_STEP).round(2)
+    return day
+
+def _render_pngs(figs) -> dict:
+    """name -> PNG bytes (kaleido), all figures submitted at once to a thread pool."""
+    with ThreadPoolExecutor(max_workers=max(len(figs), 1)) as ex:
+        pngs = ex.map(lambda f: f.to_image(format="png", scale=2), [fig for _, fig in figs])
+        return dict(zip([name for name, _ in figs], pngs))
 
 # --- load data (never crash silently) ---
 try:
-    with get_session() as sess:
-        user = sess.exec(select(User)).first()
-        daily = load_daily_df(sess, user.id) if user else pd.DataFrame()
-        weekly = load_weekly_df(sess, user.id) if user else pd.DataFrame()
+    user = current_user()
+    daily = cached_daily_df(user.id) if user else pd.DataFrame()
+    weekly = cached_weekly_df(user.id) if user else pd.DataFrame()
 except Exception as e:
     st.error("Failed to load data.")
     st.exception(e)
@@ -56,20 +78,8 @@ min_d = pd.to_datetime(daily["date"]).dt.date.min()
 max_d = pd.to_datetime(daily["date"]).dt.date.max()
 dr = st.date_input("Date range", value=(min_d, max_d))
 
-# --- prepare day-level frame (same logic as dashboard) ---
-d = daily.copy()
-d["day"] = pd.to_datetime(d["date"], utc=True, errors="coerce").dt.normalize()
-d = d[(d["day"].dt.date >= dr[0]) & (d["day"].dt.date <= dr[1])]
-d["weight_kg"] = pd.to_numeric(d["weight_kg"], errors="coerce")
-d["steps"] = pd.to_numeric(d["steps"], errors="coerce")
-day = (
-    d.set_index("day")
-     .sort_index()
-     .resample("D")
-     .mean(numeric_only=True)
-     .reset_index()
-)
-day["km_calc"] = steps_to_km(day["steps"]).round(2)
+# --- prepare day-level frame ---
+day = _prep(user.id, dr[0], dr[1])
 
 # Quick stats
 c1, c2, c3 = st.columns(3)
@@ -113,6 +123,19 @@ else:
 st.markdown("---")
 
 # --- Export buttons ---
+# Render every chart once; the ZIP and the PDF share the same bytes, and reruns with
+# the same range and chart data reuse them from session_state instead of re-rendering.
+pngs, png_error = {}, None
+if px is not None and "kaleido" not in _missing:
+    fig_key = (dr[0], dr[1], hashlib.sha1("".join(f.to_json() for _, f in figs).encode()).hexdigest())
+    try:
+        if st.session_state.get("_png_key") != fig_key:
+            st.session_state["_pngs"] = _render_pngs(figs)  # requires kaleido
+            st.session_state["_png_key"] = fig_key
+        pngs = st.session_state["_pngs"]
+    except Exception as e:
+        png_error = e
+
 col_png, col_pdf = st.columns(2)
 
 with col_png:
@@ -126,11 +149,12 @@ with col_png:
             st.caption("Install: `pip install kaleido`")
         else:
             try:
+                if png_error is not None:
+                    raise png_error
                 import zipfile
                 png_zip = io.BytesIO()
                 with zipfile.ZipFile(png_zip, "w", zipfile.ZIP_DEFLATED) as zf:
-                    for name, fig in figs:
-                        img_bytes = fig.to_image(format="png", scale=2)  # requires kaleido
+                    for name, img_bytes in pngs.items():
                         zf.writestr(name, img_bytes)
                 png_zip.seek(0)
                 st.download_button(
@@ -152,6 +176,8 @@ with col_pdf:
         st.caption("Install: `pip install plotly kaleido`")
     else:
         try:
+            if png_error is not None:
+                raise png_error
             # Build PDF
             buf = io.BytesIO()
             c = canvas.Canvas(buf, pagesize=A4)
@@ -167,9 +193,8 @@ with col_pdf:
             c.drawString(2*cm, H-4.7*cm, f"Generated: {dt.datetime.now().strftime('%Y-%m-%d %H:%M')}")
             c.showPage()
 
-            def add_plot(fig, title):
-                png = fig.to_image(format="png", scale=2)  # kaleido
-                img = ImageReader(io.BytesIO(png))
+            def add_plot(png_bytes, title):
+                img = ImageReader(io.BytesIO(png_bytes))
                 c.setFont("Helvetica-Bold", 14)
                 c.drawString(2*cm, H-2.0*cm, title)
                 iw, ih = img.getSize()
@@ -180,14 +205,14 @@ with col_pdf:
                 c.showPage()
 
             # Add charts
-            for name, fig in figs:
+            for name, png in pngs.items():
                 title = {
                     "weight.png": "Daily Weight (smoothed)",
                     "steps.png": "Daily Steps",
                     "km.png": "Daily KM (derived)",
                     "weekly_change.png": "Weekly Weight Change",
                 }.get(name, name)
-                add_plot(fig, title)
+                add_plot(png, title)
 
             c.save()
             buf.seek(0)
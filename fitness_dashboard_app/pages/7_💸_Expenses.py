@@ -1,19 +1,24 @@
 # pages/7_💸_Expenses.py
 import streamlit as st
-import pandas as pd
 from datetime import date
 from sqlmodel import select
-from db import get_session
-from models import User, Expense
-from utils import load_css, DEFAULT_EXPENSE_CATEGORIES, load_expenses_df, expense_metrics
+from sqlalchemy import func
+from db import get_session, current_user
+from models import Expense
+from utils import load_css, DEFAULT_EXPENSE_CATEGORIES, load_recent_expenses_df, to_arrow_expenses, expense_summary
 
 st.set_page_config(page_title="💸 Expenses", page_icon="💸", layout="wide")
 load_css(show_warning=False)
 
 st.title("💸 Health Expenses")
 
-with get_session() as sess:
-    user = sess.exec(select(User)).first()
+@st.cache_data(show_spinner=False)
+def load_expenses_table_cached(user_id: int, version: tuple, limit: int):
+    """Newest ``limit`` rows (sorted by SQL) as an Arrow table; ``version`` (row count, max id) changes whenever rows are added or removed."""
+    with get_session() as sess:
+        return to_arrow_expenses(load_recent_expenses_df(sess, user_id, limit))
+
+user = current_user()
 
 # --- Entry form ---
 with st.form("add_expense", clear_on_submit=True):
@@ -31,43 +36,44 @@ with st.form("add_expense", clear_on_submit=True):
     if submitted:
         final_cat = other.strip() if other.strip() else cat
         with get_session() as sess:
-            row = Expense(user_id=user.id, date=pd.to_datetime(d).date(), amount=float(amt), category=final_cat, note=note or None)
+            row = Expense(user_id=user.id, date=d, amount=float(amt), category=final_cat, note=note or None)
             sess.add(row)
             sess.commit()
+        st.cache_data.clear()  # includes load_expenses_table_cached
         st.success("Expense added!")
 
 st.divider()
 
 # --- Listing & quick stats ---
 with get_session() as sess:
-    df = load_expenses_df(sess, user.id)
-
-# --- normalize types for safe .dt / math ---
-if df is None or df.empty:
-    df = pd.DataFrame(columns=["date", "amount", "category", "note"])
-
-df["date"] = pd.to_datetime(df["date"], errors="coerce")
-df["amount"] = pd.to_numeric(df["amount"], errors="coerce").fillna(0)
-df = df.dropna(subset=["date"])  # remove rows without a valid date
-
-metrics = expense_metrics(df) if callable(expense_metrics) else {}
+    version = tuple(sess.exec(
+        select(func.count(Expense.id), func.max(Expense.id)).where(Expense.user_id == user.id)
+    ).one())
+    # the metrics are SQL aggregates over all history; the frame is only for the listing.
+    # With no expenses yet, skip the aggregate (and, below, the listing load) entirely.
+    summary = (
+        expense_summary(sess, user.id) if version[0]
+        else {"total": 0.0, "last30": 0.0, "this_month": 0.0}
+    )
 
 c1, c2, c3 = st.columns([1,1,2])
 with c1:
-    total_all = float(metrics.get("total", df["amount"].sum()))
-    st.metric("Total spend (all time)", f"₹ {total_all:,.0f}")
+    st.metric("Total spend (all time)", f"₹ {summary['total']:,.0f}")
 with c2:
-    last_30 = df[df["date"] >= (pd.Timestamp.today() - pd.Timedelta(days=30))]
-    st.metric("Last 30 days", f"₹ {last_30['amount'].sum():,.0f}")
+    st.metric("Last 30 days", f"₹ {summary['last30']:,.0f}")
 with c3:
-    cur_period = pd.Timestamp.today().to_period("M")
-    month_period = df["date"].dt.to_period("M")
-    this_month = df[month_period == cur_period]
-    st.metric("This month", f"₹ {this_month['amount'].sum():,.0f}")
+    st.metric("This month", f"₹ {summary['this_month']:,.0f}")
 
 st.subheader("All expenses")
+if not version[0]:
+    st.info("No expenses yet. Add one above.")
+    st.stop()
+limit = st.number_input("Rows to show", min_value=100, max_value=5000, value=500, step=100)
+table = load_expenses_table_cached(user.id, version, int(limit))
+if version[0] > len(table):
+    st.caption(f"Showing the {len(table):,} most recent of {version[0]:,} expenses.")
 st.dataframe(
-    df.sort_values("date", ascending=False),
+    table,
     use_container_width=True,
     hide_index=True
 )
\ No newline at end of file
@@ -1,33 +1,55 @@
 # utils.py
 # Robust helpers for loading daily/weekly dataframes, and a safe CSS loader.
 
+from datetime import date, timedelta
+from functools import lru_cache
 from pathlib import Path
 import streamlit as st
-from sqlmodel import Session, select
+from sqlmodel import Session
+from sqlalchemy import case, func, select, text
+import numpy as np
 import pandas as pd
-from models import DailyMetric, Week, Measurement, Wellbeing, Adherence
+from db import get_session
+from models import DailyMetric, Measurement, Wellbeing, Adherence
 
 
 # ---- UI helpers --------------------------------------------------------------
 
-def load_css(relative_path: str = "assets/style.css", show_warning: bool = False) -> None:
-    """Safely load CSS regardless of where Streamlit executes the page.
+@lru_cache(maxsize=8)
+def _resolve_and_read_css(relative_path: str) -> tuple:
+    """(candidates, css_file, css_text) for a stylesheet; resolved and read once per process.
 
-    - Tries multiple candidate locations relative to this file and the CWD.
-    - Never raises; optionally shows a small warning if show_warning=True.
-    - Default is silent (no warnings) to avoid noisy UIs.
+    css_file is None when no candidate exists; css_text is None when reading failed.
     """
     here = Path(__file__).resolve().parent
 
     # Candidate search locations (first hit wins)
-    candidates = [
+    candidates = (
         here / relative_path,                                  # fitness_dashboard_app/assets/style.css
         here.parent / relative_path,                           # project_root/assets/style.css (fallback)
         Path.cwd() / "fitness_dashboard_app" / relative_path,  # CWD/fitness_dashboard_app/assets/style.css
         Path.cwd() / relative_path,                            # CWD/assets/style.css
-    ]
+    )
 
     css_file = next((p for p in candidates if p.exists()), None)
+    if not css_file:
+        return candidates, None, None
+    try:
+        return candidates, css_file, css_file.read_text(encoding="utf-8")
+    except Exception:
+        return candidates, css_file, None
+
+
+def load_css(relative_path: str = "assets/style.css", show_warning: bool = False) -> None:
+    """Safely load CSS regardless of where Streamlit executes the page.
+
+    - Tries multiple candidate locations relative to this file and the CWD.
+    - Never raises; optionally shows a small warning if show_warning=True.
+    - Default is silent (no warnings) to avoid noisy UIs.
+    - The file lookup and read are cached; only the <style> emit runs per rerun
+      (it has to: elements not re-emitted on a rerun are dropped from the page).
+    """
+    candidates, css_file, css = _resolve_and_read_css(relative_path)
     if not css_file:
         if show_warning:
             st.caption(
@@ -37,13 +59,12 @@ def load_css(relative_path: str = "assets/style.css", show_warning: bool = False
             )
         return
 
-    try:
-        st.markdown(f"<style>{css_file.read_text(encoding='utf-8')}</style>", unsafe_allow_html=True)
-    except Exception:
+    if css is None:
         # Never break the app due to styling issues
         if show_warning:
             st.caption(f"Warning: failed to load stylesheet at {css_file}")
         return
+    st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
 
 
 # ---- Defaults to keep the dashboard stable even with missing data ----
@@ -60,106 +81,148 @@ def _ensure_weekly_cols(df: pd.DataFrame) -> pd.DataFrame:
     """Guarantee the weekly DF has all expected columns."""
     if df is None or df.empty:
         # Return an empty frame with every column present so downstream code won’t KeyError
-        out = pd.DataFrame()
-        for c in REQUIRED_WEEKLY_COLS:
-            out[c] = pd.Series(dtype="float64")
-        return out
-    for c in REQUIRED_WEEKLY_COLS:
-        if c not in df.columns:
-            df[c] = pd.NA
+        return pd.DataFrame({c: pd.Series(dtype="float64") for c in REQUIRED_WEEKLY_COLS})
+    # add any missing columns in one reindex rather than one insert (and block) per column
+    missing = [c for c in REQUIRED_WEEKLY_COLS if c not in df.columns]
+    if missing:
+        df = df.reindex(columns=list(df.columns) + missing, fill_value=pd.NA)
     return df
 
 
-def _to_dict(obj):
-    """Works for Pydantic v2 (model_dump) and v1 (dict), else fallback."""
-    if hasattr(obj, "model_dump"):
-        return obj.model_dump()
-    if hasattr(obj, "dict"):
-        return obj.dict()
-    return dict(obj.__dict__)
+def _read_user_rows(sess: Session, model_cls, user_id: int, parse_dates=None) -> pd.DataFrame:
+    """All of a user's rows of `model_cls`, read straight from the cursor (no ORM objects or dicts).
+
+    Read-only reporting path; writes keep going through the ORM. An empty result still
+    carries every table column.
+    """
+    table = model_cls.__table__
+    stmt = table.select().where(table.c.user_id == user_id)
+    return pd.read_sql_query(stmt, sess.connection(), parse_dates=parse_dates)
 
 
 # ---- Public API ---------------------------------------------------------------
 
 def load_daily_df(sess: Session, user_id: int) -> pd.DataFrame:
     """Return a dataframe of daily metrics for a user."""
-    rows = sess.exec(select(DailyMetric).where(DailyMetric.user_id == user_id)).all()
-    if not rows:
-        return pd.DataFrame(columns=["id", "user_id", "date", "week_id", "weight_kg", "steps", "run_km"])
-    df = pd.DataFrame([_to_dict(r) for r in rows])
-    if not df.empty and "date" in df.columns:
-        df["date"] = pd.to_datetime(df["date"])
-    return df
+    return _read_user_rows(sess, DailyMetric, user_id, parse_dates=["date"])
+
+
+# Per-week aggregate, run as the CTE of _WEEKLY_SQL below.
+# Grouped from the dailies (weeks without dailies are omitted, dailies without a week form a
+# week_id=NULL row) and ordered by week_number with NULLs last, as the Dashboard always showed.
+_WEEKLY_AGG_SQL = text("""
+    SELECT d.week_id,
+           w.week_number,
+           w.start_date,
+           AVG(d.weight_kg) AS avg_weight_kg,
+           AVG(d.steps)     AS avg_steps,
+           AVG(d.weight_kg) - LAG(AVG(d.weight_kg)) OVER (
+               ORDER BY w.week_number IS NULL, w.week_number
+           ) AS weekly_weight_loss
+    FROM dailymetric d
+    LEFT JOIN week w ON w.id = d.week_id AND w.user_id = d.user_id
+    WHERE d.user_id = :u
+    GROUP BY d.week_id
+    ORDER BY w.week_number IS NULL, w.week_number
+""")
+
+
+# The aggregate plus each week's Measurement/Wellbeing/Adherence row (week_id is unique in
+# those tables) in one round trip instead of one SELECT per table.
+_WEEKLY_SIDE_TABLES = {"m": Measurement, "wb": Wellbeing, "ad": Adherence}
+_WEEKLY_SIDE_COLS = {
+    alias: [c.name for c in model.__table__.columns if c.name not in ("id", "user_id", "week_id")]
+    for alias, model in _WEEKLY_SIDE_TABLES.items()
+}
+_WEEKLY_SQL = text(
+    "WITH agg AS (" + _WEEKLY_AGG_SQL.text + ")\n"
+    "    SELECT agg.*, "
+    + ", ".join(f"{alias}.{c}" for alias, cols in _WEEKLY_SIDE_COLS.items() for c in cols)
+    + "\n    FROM agg\n"
+    + "".join(
+        f"    LEFT JOIN {model.__tablename__} {alias} ON {alias}.week_id = agg.week_id AND {alias}.user_id = :u\n"
+        for alias, model in _WEEKLY_SIDE_TABLES.items()
+    )
+    + "    ORDER BY agg.week_number IS NULL, agg.week_number"
+)
 
 
 def load_weekly_df(sess: Session, user_id: int) -> pd.DataFrame:
     """
     Build a weekly dataframe with:
-      - avg_weight_kg, avg_steps (from dailies)
-      - weekly_weight_loss (diff of avg weight)
-      - merged weekly tables: measurements, wellbeing, adherence
+      - avg_weight_kg, avg_steps, weekly_weight_loss (SQL aggregate over dailies)
+      - joined weekly tables: measurements, wellbeing, adherence
     """
-    d = load_daily_df(sess, user_id)
-    if d.empty:
+    out = pd.read_sql_query(_WEEKLY_SQL, sess.connection(), params={"u": user_id})
+    if out.empty:
         return _ensure_weekly_cols(pd.DataFrame())
+    out["start_date"] = pd.to_datetime(out["start_date"]).dt.date
+    # all-NULL columns come back as object; keep every check-in value numeric
+    side = [c for cols in _WEEKLY_SIDE_COLS.values() for c in cols]
+    out[side] = out[side].astype("float64")
 
-    # Base week table
-    weeks = sess.exec(select(Week).where(Week.user_id == user_id)).all()
-    w = pd.DataFrame([_to_dict(x) for x in weeks]) if weeks else pd.DataFrame(columns=["id", "user_id", "week_number", "start_date"])
+    # Ensure all expected columns exist
+    out = _ensure_weekly_cols(out)
+    return out
 
-    # Weekly aggregates from dailies
-    if "week_id" not in d.columns:
-        return _ensure_weekly_cols(pd.DataFrame())
 
-    avg = (
-        d.groupby("week_id", dropna=False)
-        .agg(avg_weight_kg=("weight_kg", "mean"), avg_steps=("steps", "mean"))
-        .reset_index()
-    )
+def rolling_avg(series: pd.Series, window: int = 7) -> pd.Series:
+    """7-day rolling average with graceful handling for short series.
 
-    # Merge with weeks to get week_number/start_date
-    if not w.empty:
-        out = avg.merge(
-            w[["id", "week_number", "start_date"]],
-            left_on="week_id", right_on="id", how="left"
-        ).drop(columns=["id"])
-    else:
-        out = avg.copy()
-        out["week_number"] = pd.NA
-        out["start_date"] = pd.NA
-
-    # Optional weekly tables
-    def table_df(model_cls, cols):
-        rows = sess.exec(select(model_cls).where(model_cls.user_id == user_id)).all()
-        return pd.DataFrame([_to_dict(r) for r in rows]) if rows else pd.DataFrame(columns=["id", "user_id", "week_id"] + cols)
-
-    m = table_df(Measurement, ["r_biceps_in", "l_biceps_in", "chest_in", "r_thigh_in", "l_thigh_in", "waist_navel_in"])
-    wb = table_df(Wellbeing, ["sleep_issues", "hunger_issues", "stress_issues"])
-    ad = table_df(Adherence, ["diet_score", "workout_score"])
-
-    for frame in (m, wb, ad):
-        if not frame.empty:
-            # Keep only one row per week_id if duplicates exist
-            frame = frame.sort_values(by="id").drop_duplicates(subset=["week_id"], keep="last")
-            out = out.merge(
-                frame.drop(columns=[c for c in ["id", "user_id"] if c in frame.columns]),
-                on="week_id",
-                how="left",
-            )
+    Same result as ``rolling(window, min_periods=1).mean()`` (NaNs skipped; NaN where a
+    window has no values), computed from two cumulative sums instead of the rolling engine.
+    """
+    a = pd.to_numeric(series, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    valid = ~np.isnan(a)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(valid, a, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(valid)))
+    hi = np.arange(1, a.size + 1)
+    lo = np.maximum(hi - window, 0)
+    n = counts[hi] - counts[lo]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = np.where(n > 0, (sums[hi] - sums[lo]) / n, np.nan)
+    return pd.Series(out, index=series.index, name=series.name)
 
-    # Order and derived fields
-    if "week_number" in out.columns:
-        out = out.sort_values("week_number", na_position="last")
-    out["weekly_weight_loss"] = out["avg_weight_kg"].diff(1)
 
-    # Ensure all expected columns exist
-    out = _ensure_weekly_cols(out)
-    return out
+# ---- Chart helpers -------------------------------------------------------------
+MAX_CHART_POINTS = 1000
 
 
-def rolling_avg(series: pd.Series, window: int = 7) -> pd.Series:
-    """7-day rolling average with graceful handling for short series."""
-    return series.rolling(window=window, min_periods=1).mean()
+def downsample_minmax(frame: pd.DataFrame, y: str, n_out: int = MAX_CHART_POINTS) -> pd.DataFrame:
+    """Thin a time-ordered frame to ~n_out rows for plotting, keeping each bucket's min and max of `y`.
+
+    Peaks and dips survive (unlike plain striding); short frames are returned untouched.
+    """
+    n = len(frame)
+    if n <= n_out:
+        return frame
+    n_buckets = max(1, n_out // 2)
+    size = -(-n // n_buckets)  # ceil
+    vals = pd.to_numeric(frame[y], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = vals
+    grid = padded.reshape(n_buckets, size)
+    offsets = np.arange(n_buckets) * size
+    lo = offsets + np.argmin(np.where(np.isnan(grid), np.inf, grid), axis=1)
+    hi = offsets + np.argmax(np.where(np.isnan(grid), -np.inf, grid), axis=1)
+    idx = np.unique(np.concatenate(([0, n - 1], lo, hi)))
+    return frame.iloc[idx[idx < n]]
+
+
+# ---- Steps → KM (8 km per 1780×5 steps) ----------------------------------------
+KM_PER_STEP = 8.0 / (1780.0 * 5.0)
+
+
+def steps_to_km_scalar(steps: int | float | None) -> float | None:
+    """KM for a single step count; no pandas machinery for one number."""
+    return steps * KM_PER_STEP if steps else None
+
+
+def steps_to_km_series(steps: pd.Series) -> pd.Series:
+    """KM for a Series of step counts (non-numeric → NaN), as one NumPy multiply."""
+    s = pd.to_numeric(steps, errors="coerce")
+    km = s.to_numpy(dtype="float64", na_value=float("nan")) * KM_PER_STEP
+    return pd.Series(km, index=s.index, name=s.name)
 
 # ---- Expenses helpers -------------------------------------------------------
 from models import Expense
@@ -168,15 +231,65 @@ DEFAULT_EXPENSE_CATEGORIES = [
     "Supplements", "Coaching", "Gym", "Physio", "Equipment", "Tests", "Food/Meal Plan", "Other"
 ]
 
-def load_expenses_df(sess: Session, user_id: int) -> pd.DataFrame:
-    rows = sess.exec(select(Expense).where(Expense.user_id == user_id)).all()
-    if not rows:
-        return pd.DataFrame(columns=["id","user_id","date","amount","category","note"])
-    df = pd.DataFrame([_to_dict(r) for r in rows])
-    if "date" in df.columns:
-        df["date"] = pd.to_datetime(df["date"])
+def _compact_expense_cols(df: pd.DataFrame) -> pd.DataFrame:
+    """Low-cardinality category as a Categorical; note as Arrow strings when pyarrow is installed."""
+    df["category"] = df["category"].astype("category")
+    try:
+        df["note"] = df["note"].astype("string[pyarrow]")
+    except ImportError:
+        pass
     return df
 
+def load_expenses_df(sess: Session, user_id: int) -> pd.DataFrame:
+    return _compact_expense_cols(_read_user_rows(sess, Expense, user_id, parse_dates=["date"]))
+
+def load_recent_expenses_df(sess: Session, user_id: int, limit: int = 500) -> pd.DataFrame:
+    """The user's ``limit`` most recent expenses, newest first (ORDER BY/LIMIT run in SQLite)."""
+    table = Expense.__table__
+    stmt = (
+        table.select()
+        .where(table.c.user_id == user_id)
+        .order_by(table.c.date.desc(), table.c.id.desc())
+        .limit(limit)
+    )
+    return _compact_expense_cols(pd.read_sql_query(stmt, sess.connection(), parse_dates=["date"]))
+
+def to_arrow_expenses(df: pd.DataFrame):
+    """The expenses frame as a pyarrow Table (dates as date32) for st.dataframe.
+
+    Built once per cached load so reruns hand Streamlit Arrow data directly instead of
+    converting the DataFrame each time. Returns ``df`` unchanged when pyarrow is missing.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+    except ImportError:
+        return df
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    i = table.schema.get_field_index("date")
+    if i >= 0 and pa.types.is_timestamp(table.schema.field(i).type):
+        table = table.set_column(i, "date", pc.cast(table.column(i), pa.date32()))
+    return table
+
+def expense_summary(sess: Session, user_id: int, today: date | None = None) -> dict:
+    """All-time, last-30-days and this-month spend as one SQL aggregate (no rows loaded).
+
+    Returns {"total", "last30", "this_month"} as floats; the windows are the last
+    30 days including today and the current calendar month.
+    """
+    today = today or date.today()
+    d30 = today - timedelta(days=29)
+    month_start = today.replace(day=1)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
+    in_month = (Expense.date >= month_start) & (Expense.date < next_month)
+    stmt = select(
+        func.coalesce(func.sum(Expense.amount), 0),
+        func.coalesce(func.sum(case((Expense.date >= d30, Expense.amount), else_=0)), 0),
+        func.coalesce(func.sum(case((in_month, Expense.amount), else_=0)), 0),
+    ).where(Expense.user_id == user_id)
+    total, last30, this_month = sess.execute(stmt).one()
+    return {"total": float(total), "last30": float(last30), "this_month": float(this_month)}
+
 def expense_metrics(df: pd.DataFrame) -> dict:
     if df is None or df.empty:
         return {
@@ -187,13 +300,35 @@ def expense_metrics(df: pd.DataFrame) -> dict:
     out = {}
     out["total"] = float(df["amount"].sum())
 
-    d_month = df.copy()
-    d_month["month"] = d_month["date"].dt.to_period("M").dt.to_timestamp()
+    # floor to month start as datetime64[M] (no Period object per row)
+    month = pd.Series(
+        df["date"].to_numpy("datetime64[ns]").astype("datetime64[M]").astype("datetime64[ns]"),
+        index=df.index, name="month",
+    )
     out["by_month"] = (
-        d_month.groupby("month", dropna=False)["amount"].sum().reset_index().sort_values("month")
+        df["amount"].groupby(month, dropna=False).sum().reset_index().sort_values("month")
     )
 
     out["by_category"] = (
-        df.groupby("category", dropna=False)["amount"].sum().reset_index().sort_values("amount", ascending=False)
+        df.groupby("category", dropna=False, observed=True)["amount"].sum().reset_index().sort_values("amount", ascending=False)
     )
-    return out
\ No newline at end of file
+    return out
+
+
+# ---- Cached loaders (shared by the read-only pages; cleared by the write pages after commit) ----
+# Defined once here so the Dashboard and the Export Report hit the same cache entries.
+
+@st.cache_data(ttl=60, show_spinner=False)
+def cached_daily_df(user_id: int) -> pd.DataFrame:
+    with get_session() as sess:
+        return load_daily_df(sess, user_id)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def cached_weekly_df(user_id: int) -> pd.DataFrame:
+    with get_session() as sess:
+        return load_weekly_df(sess, user_id)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def cached_expenses_df(user_id: int) -> pd.DataFrame:
+    with get_session() as sess:
+        return load_expenses_df(sess, user_id)